@@ -1,20 +1,116 @@
 #!/usr/bin/python3
-import argparse
-import glob
+import hashlib
+import itertools
+import os
 import pathlib
+import sys
+from typing import List
 
 import buffham.parse as bh
 
-def main(dir: pathlib.Path):
-    for bh_file in glob.glob(str(dir.absolute() / '**/*.bh'), recursive=True):
-        bh_file = pathlib.Path(bh_file)
+def cache_dir() -> pathlib.Path:
+    # Per the XDG spec, an empty or relative XDG_CACHE_HOME counts as unset
+    cache_home = pathlib.Path(os.environ.get('XDG_CACHE_HOME', ''))
+    if not cache_home.is_absolute():
+        cache_home = pathlib.Path.home() / '.cache'
+    return cache_home / 'buffham'
+
+# Generated outputs are cached by source content, keyed together with the
+# generator's digest so cached files are never reused across generator changes.
+# Least recently used entries are evicted once the cache outgrows CACHE_MAX_BYTES
+CACHE_DIR = cache_dir()
+CACHE_MAX_BYTES = 16 * 1024 * 1024
+
+def generation_key(bh_file: pathlib.Path, source: bytes) -> str:
+    # Identifies the outputs for this source under this generator. Outputs embed
+    # the file name, so it is part of the key as well
+    return hashlib.blake2b(bh.GENERATOR_DIGEST + bh_file.name.encode() + b'\0' + source,
+                           digest_size=16).hexdigest()
+
+def stamp_file(bh_file: pathlib.Path) -> pathlib.Path:
+    # The stamp records the generation key the outputs were generated under
+    return bh_file.with_name(bh_file.name + '.stamp')
+
+def stale_languages(bh_file: pathlib.Path, key: str, force: bool = False):
+    stamp = stamp_file(bh_file)
+    if force or not stamp.exists() or stamp.read_text() != key:
+        return list(bh.Languages)
+    return [language for language in bh.Languages
+            if not bh.Generator.output_file(bh_file, language).exists()]
+
+def generate_file(bh_file: pathlib.Path, key: str, languages: List[bh.Languages], force: bool = False):
+    cached_files = {language: CACHE_DIR / (key + language.value) for language in languages}
+    cached_outputs = None
+    if not force:
+        try:
+            cached_outputs = {language: cached_file.read_text() for language, cached_file in cached_files.items()}
+            for cached_file in cached_files.values():
+                os.utime(cached_file)  # Marks the entry as recently used
+        except OSError:
+            pass  # Not cached yet, or evicted meanwhile by another run
+    if cached_outputs is not None:
+        for language, cached_output in cached_outputs.items():
+            bh.Generator.write_output(bh.Generator.output_file(bh_file, language), cached_output)
+    else:
         messages = bh.Parser.parse_file(bh_file)
-        bh.Generator.generate(bh_file, messages)
+        bh.Generator.generate(bh_file, messages, languages)
+        try:
+            CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            for language, cached_file in cached_files.items():
+                bh.Generator.write_output(cached_file, bh.Generator.output_file(bh_file, language).read_text())
+        except OSError:
+            pass  # The cache is only an optimization, e.g. a read-only home directory
+
+    stamp_file(bh_file).write_text(key)
+
+def prune_cache(max_bytes: int = CACHE_MAX_BYTES):
+    try:
+        entries = [(entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in os.scandir(CACHE_DIR)]
+    except OSError:
+        return
+    cache_bytes = sum([size for _, size, _ in entries])
+    for _, size, path in sorted(entries):
+        if cache_bytes <= max_bytes:
+            break
+        try:
+            os.unlink(path)
+        except OSError:
+            pass  # Already evicted by another run
+        cache_bytes -= size
+
+def main(dir: pathlib.Path, force: bool = False):
+    # Most files are usually up to date; only hand the stale ones to workers
+    stale_files = []
+    for bh_file in dir.absolute().rglob('*.bh'):
+        key = generation_key(bh_file, bh_file.read_bytes())
+        languages = stale_languages(bh_file, key, force)
+        if languages:
+            stale_files.append((bh_file, key, languages))
+    if len(stale_files) <= 1:
+        # Not worth starting a process pool for a single file
+        for bh_file, key, languages in stale_files:
+            generate_file(bh_file, key, languages, force)
+    else:
+        import concurrent.futures
+        # Files are independent of each other, so fan them out across processes
+        with concurrent.futures.ProcessPoolExecutor() as executor:
+            list(executor.map(generate_file, *zip(*stale_files), itertools.repeat(force)))
+
+    if stale_files:
+        prune_cache()
 
 if __name__ == '__main__':
+    # Editors may regenerate on every save, so the plain `buffham_gen.py [dir]`
+    # form skips importing argparse
+    if len(sys.argv) <= 2 and not any(arg.startswith('-') for arg in sys.argv[1:]):
+        main(pathlib.Path(sys.argv[1]) if len(sys.argv) == 2 else pathlib.Path.cwd())
+        sys.exit()
+
+    import argparse
     parser = argparse.ArgumentParser(description='Generate BuffHam definitions')
-    parser.add_argument('dir', help='Directory to recursively generate through', default=str(pathlib.Path.cwd()))
+    parser.add_argument('dir', nargs='?', help='Directory to recursively generate through', default=str(pathlib.Path.cwd()))
+    parser.add_argument('--force', action='store_true', help='Regenerate outputs even if their source is unchanged')
     
     args = parser.parse_args()
 
-    main(pathlib.Path(args.dir))
+    main(pathlib.Path(args.dir), args.force)
@@ -1,8 +1,12 @@
 import pathlib
-import textwrap
 import enum
+import hashlib
+import io
+import itertools
+import os
 import re
-from typing import List, Optional, Tuple
+import types
+from typing import ClassVar, Dict, Iterable, List, Optional, Tuple
 
 class Types(enum.Enum):
     UINT8 = enum.auto()
@@ -78,352 +82,489 @@ PY_STRUCT_MAP = {
     Types.INT64: 'q'
 }
 
+# https://numpy.org/doc/stable/reference/arrays.dtypes.html
+PY_DTYPE_MAP = {
+    Types.UINT8: 'u1',
+    Types.UINT16: '<u2',
+    Types.UINT32: '<u4',
+    Types.UINT64: '<u8',
+    Types.INT8: 'i1',
+    Types.INT16: '<i2',
+    Types.INT32: '<i4',
+    Types.INT64: '<i8'
+}
+
+
+# File headers and per-message scaffolding for each language. Only names,
+# sizes and the per-field fragments vary; everything else is fixed here.
+#
+# Python messages share module-level struct.Struct objects, one per distinct
+# field layout, so each format is compiled once at import no matter how many
+# messages use it. The header leads each format, so a message encodes or
+# decodes in a single pack or unpack call. Each message also has a NumPy
+# structured dtype of its whole wire layout, header included, for encoding and
+# decoding in bulk.
+#
+# C/C++ structs are packed, so their layout is the wire payload and a message
+# encodes or decodes with a single memcpy. Static asserts on the size and every
+# field's offset catch a compiler that does not honour the packing.
+_PYTHON_HEADER_TEMPLATE = '''\
+\"\"\"
+AUTOGENERATED CODE. DO NOT EDIT.
+Buffham generated from {name}
+\"\"\"
+import numpy as np
+import struct
+from typing import Iterator
+
+BUFFHAM_HASH = '{schema_hash}'
+
+{structs}
+
+'''
+
+_PYTHON_DEFINITION_TEMPLATE = '''\
+class {name}:
+{attribute_definitions}
+    __slots__ = {slots!r}
+    _BH_SIZE = {struct}.size
+    _BH_DTYPE = np.dtype([('_bh_magic', 'S2'), ('_bh_id', 'u1'), ('_bh_size', '<u2'), {dtype_fields}])
+
+    def __init__(self, {constructor_args}):
+{constructor_body}
+    def buffer_size(self) -> int:
+        return self._BH_SIZE
+
+    def encode(self) -> bytes:
+        return {struct}.pack(b'Bh', {id}, {payload_size}, {encode_values})
+
+    def decode(buffer: bytes) -> '{name}':
+        e = {struct}.unpack(buffer)
+        assert e[0] == b'Bh'
+        assert e[1] == {id}
+        assert e[2] == {payload_size}
+        return {name}({decode_values})
+
+    @classmethod
+    def iter_decode(cls, buffer: bytes) -> Iterator['{name}']:
+        # Decodes back-to-back messages lazily, without slicing the buffer
+        for e in {struct}.iter_unpack(memoryview(buffer)):
+            assert e[0] == b'Bh'
+            assert e[1] == {id}
+            assert e[2] == {payload_size}
+            yield cls({decode_values})
+
+    @classmethod
+    def encode_many(cls, values) -> bytes:
+        # `values` is a structured array or a mapping of per-field columns
+        records = np.empty(len(values[{first_attr!r}]), dtype=cls._BH_DTYPE)
+        records['_bh_magic'] = b'Bh'
+        records['_bh_id'] = {id}
+        records['_bh_size'] = {payload_size}
+        for attr_name in cls.__slots__:
+            records[attr_name] = values[attr_name]
+        return records.tobytes()
+
+    @classmethod
+    def decode_many(cls, buffer: bytes) -> np.ndarray:
+        records = np.frombuffer(buffer, dtype=cls._BH_DTYPE)
+        assert (records['_bh_magic'] == b'Bh').all()
+        assert (records['_bh_id'] == {id}).all()
+        assert (records['_bh_size'] == {payload_size}).all()
+        return records
+
+'''
+
+_CXX_HEADER_TEMPLATE = '''\
+/*
+ * AUTOGENERATED CODE. DO NOT EDIT.
+ * Buffham generated from {name}
+ */
+#define {hash_macro} "{schema_hash}"
+
+#include <array>
+#include <cassert>
+#include <cstddef>
+#include <stdint.h>
+#include <string.h>
+
+
+'''
+
+_CXX_DEFINITION_TEMPLATE = '''\
+#pragma pack(push, 1)
+struct {name} {{
+{attribute_definitions}
+    size_t buffer_size() const {{
+        return {total_size};
+    }}
+
+    std::array<uint8_t, {total_size}> encode() const {{
+        std::array<uint8_t, {total_size}> _buffer;
+        uint8_t* _ptr = _buffer.data();
+        _ptr[0] = {header[0]:#04x};
+        _ptr[1] = {header[1]:#04x};
+        _ptr[2] = {header[2]:#04x};
+        _ptr[3] = {header[3]:#04x};
+        _ptr[4] = {header[4]:#04x};
+        memcpy(_ptr + {header_size}, this, {payload_size});
+        return _buffer;
+    }}
+
+    static {name} decode(const uint8_t* buffer, size_t len) {{
+        const uint8_t* _ptr = buffer;
+        assert(len >= {total_size});
+        assert(*(_ptr + 0) == 'B');
+        assert(*(_ptr + 1) == 'h');
+        assert(*(_ptr + 2) == {id});
+        assert((_ptr[3] | _ptr[4] << 8) == {payload_size});
+        {name} msg;
+        memcpy(&msg, _ptr + {header_size}, {payload_size});
+        return msg;
+    }}
+}};
+#pragma pack(pop)
+{layout_asserts}
+'''
+
+_C_HEADER_TEMPLATE = '''\
+/*
+ * AUTOGENERATED CODE. DO NOT EDIT.
+ * Buffham generated from {name}
+ */
+#define {hash_macro} "{schema_hash}"
+
+#include <stddef.h>
+#include <stdint.h>
+#include <stdlib.h>
+#include <string.h>
+
+
+'''
+
+_C_DEFINITION_TEMPLATE = '''\
+#pragma pack(push, 1)
+typedef struct {{
+{attribute_definitions}\
+}} {name};
+#pragma pack(pop)
+{layout_asserts}
+
+size_t {name}_buffer_size({name}* inst) {{
+    return {total_size};
+}}
+
+uint8_t* {name}_encode({name}* inst) {{
+    uint8_t* buffer = (uint8_t*)malloc({total_size});
+    buffer[0] = {header[0]:#04x};
+    buffer[1] = {header[1]:#04x};
+    buffer[2] = {header[2]:#04x};
+    buffer[3] = {header[3]:#04x};
+    buffer[4] = {header[4]:#04x};
+    memcpy(buffer + {header_size}, inst, {payload_size});
+    return buffer;
+}}
+
+{name} {name}_decode(uint8_t* buffer, size_t len) {{
+    {name} msg;
+    memcpy(&msg, buffer + {header_size}, {payload_size});
+    return msg;
+}}
+
+'''
+
+# C and C++ share one emitter; these are the only things that differ
+_C_FAMILY_TEMPLATES = {
+    Languages.Cxx: (_CXX_HEADER_TEMPLATE, _CXX_DEFINITION_TEMPLATE, 'static_assert'),
+    Languages.C: (_C_HEADER_TEMPLATE, _C_DEFINITION_TEMPLATE, '_Static_assert'),
+}
+
+# Identifies what this generator emits; stamps and cached outputs made under a
+# different digest are regenerated. Template and type table edits change it on
+# their own; bump GENERATOR_VERSION for any other change to the generated code
+GENERATOR_VERSION = 1
+GENERATOR_DIGEST = hashlib.blake2b(repr((GENERATOR_VERSION, LANGUAGE_TYPES, PY_STRUCT_MAP, PY_DTYPE_MAP,
+                                         _PYTHON_HEADER_TEMPLATE, _PYTHON_DEFINITION_TEMPLATE,
+                                         _C_FAMILY_TEMPLATES)).encode('utf-8')).digest()
+
+# Keyed by the type's token in a .bh file, as matched by _LINE_RE
+_TYPE_BY_NAME = {_type.name.lower().encode('ascii'): _type for _type in Types}
+
+# Classifies each line of a .bh file; `lastgroup` names the kind of line. Runs
+# of comment or blank lines match as one, since repeats never change the
+# parser's state. .bh syntax is pure ASCII, so files are matched as bytes
+# without decoding them
+_LINE_RE = re.compile(rb'^(?:message (?P<msg>[A-Za-z_]\w*):'
+                      rb'|[ \t]*(?P<attr_type>' + b'|'.join(_TYPE_BY_NAME) + rb')'
+                      rb'[ \t]+(?P<attr_name>[A-Za-z_]\w*)[ \t]*'
+                      rb'|(?P<comment>[ \t]*#.*(?:\n[ \t]*#.*)*)'
+                      rb'|(?P<blank>[ \t]*(?:\r?\n[ \t]*)*)'
+                      rb'|(?P<error>.+))\r?$', re.MULTILINE)
+
 
 class Message:
-    def __init__(self, name: str, attributes: List[Tuple[str, Types]], id: int):
+    def __init__(self, name: str, attributes: Iterable[Tuple[str, Types]], id: int):
         self.name = name
-        self.attributes = attributes
+        # Ordered (name, type) pairs, frozen so the derived tables below can't go stale
+        self.attributes = tuple(attributes)
         self.id = id
 
-        assert self.payload_size() < 0xFFFF
+        # Sizes, offsets and the header are fixed by the attributes, so compute them once
+        sizes = [TYPE_SIZES[attr_type] for _, attr_type in self.attributes]
+        self._offsets = tuple(itertools.accumulate(sizes, initial=0))[:-1]
+        self._payload_size = sum(sizes)
+        assert self._payload_size < 0xFFFF
+
+        self._header = b'Bh' + self.id.to_bytes(1, 'little') + self._payload_size.to_bytes(2, 'little')
+        # The header's magic, id and payload size lead the format
+        self._struct_format = '2sBH' + ''.join([PY_STRUCT_MAP[attr_type] for _, attr_type in self.attributes])
 
     def header(self) -> bytes:
-        return b'Bh' + self.id.to_bytes(1, 'little') + self.payload_size().to_bytes(2, 'little')
+        return self._header
 
     def header_hex_array(self) -> List[str]:
-        return re.findall('..', '%08x' % int.from_bytes(self.header(), 'big'))
+        header_hex = self._header.hex()
+        return [header_hex[i:i + 2] for i in range(0, len(header_hex), 2)]
 
     def total_size(self) -> int:
-        return self.header_size() + self.payload_size()
+        return self.header_size() + self._payload_size
 
     def header_size(self) -> int:
         # 'Bh' | message_id | payload_size
         return 5
 
     def payload_size(self) -> int:
-        size = 0
-        for _, attr_type in self.attributes:
-            size += TYPE_SIZES[attr_type]
-        return size
+        return self._payload_size
 
+    def offsets(self) -> Tuple[int, ...]:
+        # Offset of each attribute from the start of the payload
+        return self._offsets
 
-class Parser:
-    MESSAGE_RE = re.compile(r'^message (.*):$')
-    ATTRIBUTE_RE = re.compile(f'^[\ |\t]*((?:{"|".join([_type.name.lower() for _type in Types])}))\ *(.*)$')
-    COMMENT_RE = re.compile(r'^[\ |\t]*#.*$')
+    def struct_format(self) -> str:
+        # Python struct format of the whole message, without the byte order
+        return self._struct_format
 
-    message_id = 0
 
+class Parser:
     @staticmethod
     def parse_file(file: pathlib.Path) -> List[Message]:
-        messages = []
-        data = file.read_text().split('\n')
-        
-        idx = 0
-        while idx < len(data):
-            name = Parser._match_top_level_message(data[idx])
-            if name:
-                idx = Parser._parse_message(data, idx + 1, name, messages)
-            elif Parser._is_comment(data[idx]):
-                pass
-            elif len(data[idx]):
-                raise ValueError(f'Failed to parse {data[idx]} as top-level '
-                                  'message declaration')
-            idx += 1
-        
+        messages: List[Message] = []
+
+        # Declaration of the message whose attributes are being parsed, if any
+        declaration: Optional[re.Match] = None
+        name = ''
+        attributes: List[Tuple[str, Types]] = []
+        for match in _LINE_RE.finditer(file.read_bytes()):
+            kind = match.lastgroup
+
+            if declaration is not None:
+                if kind == 'attr_name':
+                    attr_type, attr_name = match.group('attr_type', 'attr_name')
+                    attr_name = attr_name.decode('ascii')
+                    if attr_name.lower().startswith('_bh_'):
+                        # Generated code uses this prefix, in either case, for its own names
+                        raise Parser._error(file, match, f'Attribute name {attr_name} is reserved; '
+                                                         f'names may not start with _bh_')
+                    attributes.append((attr_name, _TYPE_BY_NAME[attr_type]))
+                    continue
+                elif kind == 'comment':
+                    continue
+                elif kind != 'blank':
+                    raise Parser._parse_error(file, match, f'an attribute of {name}')
+                Parser._finish_message(file, declaration, name, attributes, messages)
+                declaration = None
+            elif kind == 'msg':
+                declaration = match
+                name = match.group('msg').decode('ascii')
+                attributes = []
+            elif kind not in ('comment', 'blank'):
+                raise Parser._parse_error(file, match, 'top-level message declaration')
+
+        if declaration is not None:
+            Parser._finish_message(file, declaration, name, attributes, messages)
+
         return messages
 
     @staticmethod
-    def _match_top_level_message(line: str) -> Optional[str]:
-        match = Parser.MESSAGE_RE.match(line)
-        if match is None:
-            return None
-        name = match.group(1)
-        if name.isidentifier():
-            return name
-        return None
+    def _error(file: pathlib.Path, match: re.Match, message: str) -> ValueError:
+        # Line numbers are only needed for errors, so count newlines on demand
+        line_number = match.string.count(b'\n', 0, match.start()) + 1
+        return ValueError(f'{file.name}:{line_number}: {message}')
 
     @staticmethod
-    def _parse_message(data: List[str], idx: int, name: str, messages: List[Message]) -> int:
-        attributes: List[Tuple[str, Types]] = []
-        while idx < len(data):
-            attribute = Parser._match_attribute(data[idx])
-            if attribute:
-                attributes.append(attribute)
-            elif Parser._is_comment(data[idx]):
-                pass
-            elif len(data[idx]):
-                raise ValueError(f'Failed to parse {data[idx]} as an attribute'
-                                 f'of {name}')
-            else:
-                break
-            idx += 1
+    def _parse_error(file: pathlib.Path, match: re.Match, expected: str) -> ValueError:
+        line = match.group().rstrip(b'\r').decode(errors='replace')
+        return Parser._error(file, match, f'Failed to parse {line} as {expected}')
+
+    @staticmethod
+    def _finish_message(file: pathlib.Path, declaration: re.Match, name: str, attributes: List[Tuple[str, Types]],
+                        messages: List[Message]):
         if len(attributes):
-            messages.append(Message(name, attributes, Parser.message_id))
-            Parser.message_id += 1
+            # IDs are only unique within a file, so files can be parsed independently
+            messages.append(Message(name, attributes, len(messages)))
         else:
-            raise ValueError(f'Expected {name} to have attributes')
-        return idx - 1  # Back up so top-level parsing can increment
+            raise Parser._error(file, declaration, f'Expected {name} to have attributes')
+
+
+class Generator:
+    TAB: ClassVar[str] = '    '
+    # Modules built by compile_python, keyed by resolved file path and schema hash
+    _python_modules: ClassVar[Dict[Tuple[pathlib.Path, str], types.ModuleType]] = {}
 
     @staticmethod
-    def _match_attribute(line: str) -> Optional[Tuple[str, Types]]:
-        match = Parser.ATTRIBUTE_RE.match(line)
-        if match is None:
-            return None
-        name = match.group(2)
-        _type = Types[match.group(1).upper()]
-        return name, _type
+    def output_file(in_file: pathlib.Path, language: Languages) -> pathlib.Path:
+        return in_file.parent / (in_file.stem + '_bh' + language.value)
 
     @staticmethod
-    def _is_comment(line: str) -> bool:
-        return Parser.COMMENT_RE.match(line) is not None
+    def generate(in_file: pathlib.Path, messages: List[Message], languages: Iterable[Languages] = Languages):
+        # Walk the messages once, emitting every requested language side by side
+        schema_hash = Generator.schema_hash(messages)
+        outputs = {language: io.StringIO() for language in languages}
+        for language, output in outputs.items():
+            output.write(Generator._header(in_file, language, schema_hash, messages))
+        for message in messages:
+            for language, output in outputs.items():
+                output.write(Generator._definition(message, language))
 
+        for language, output in outputs.items():
+            Generator.write_output(Generator.output_file(in_file, language), output.getvalue())
 
-class Generator:
-    TAB = '    '
+    @staticmethod
+    def compile_python(in_file: pathlib.Path, messages: List[Message]) -> types.ModuleType:
+        # Build the Python output in memory and compile it in one pass, without
+        # writing or importing it; schemas seen before reuse their module
+        schema_hash = Generator.schema_hash(messages)
+        key = (in_file.resolve(), schema_hash)
+        if key not in Generator._python_modules:
+            source = Generator._header(in_file, Languages.Python, schema_hash, messages) + \
+                ''.join([Generator._definition(message, Languages.Python) for message in messages])
+            out_file = Generator.output_file(in_file, Languages.Python)
+            module = types.ModuleType(out_file.stem)
+            module.__file__ = str(out_file)
+            exec(compile(source, module.__file__, 'exec'), module.__dict__)
+            Generator._python_modules[key] = module
+        return Generator._python_modules[key]
 
     @staticmethod
-    def generate(in_file: pathlib.Path, messages: List[Message]):
-        for language in Languages:
-            out_file = in_file.parent / (in_file.stem + '_bh' + language.value)
+    def schema_hash(messages: List[Message]) -> str:
+        # Hash the parsed schema rather than the source text so comment and
+        # whitespace edits leave the generated files byte-identical
+        schema = [(message.name, message.id, [(attr_name, attr_type.name) for attr_name, attr_type in message.attributes])
+                  for message in messages]
+        return hashlib.blake2b(repr(schema).encode('utf-8'), digest_size=8).hexdigest()
 
-            if language == Languages.Cxx:
-                Generator._generate_cxx(in_file, out_file, messages)
-            elif language == Languages.C:
-                Generator._generate_c(in_file, out_file, messages)
-            elif language == Languages.Python:
-                Generator._generate_python(in_file, out_file, messages)
+    @staticmethod
+    def write_output(out_file: pathlib.Path, content: str):
+        data = content.encode('utf-8')
+        # Leave identical outputs untouched so their mtime doesn't trigger downstream rebuilds.
+        # A size mismatch settles it from the stat alone, without reading the old file
+        try:
+            if out_file.stat().st_size == len(data) and out_file.read_bytes() == data:
+                return
+        except FileNotFoundError:
+            pass
+        # Write beside the output and rename over it so readers never see a partial file.
+        # The temporary name is per process, since workers may write the same output at once
+        tmp_file = out_file.with_name(f'{out_file.name}.{os.getpid()}.tmp')
+        try:
+            tmp_file.write_bytes(data)
+            tmp_file.replace(out_file)
+        except BaseException:
+            tmp_file.unlink(missing_ok=True)
+            raise
 
     @staticmethod
-    def _generate_python(in_file: pathlib.Path, out_file: pathlib.Path, messages: List[Message]):
-        definitions = []
-        type_map = LANGUAGE_TYPES[Languages.Python]
-        for message in messages:
-            attribute_definitions = ''
-            for attr_name, attr_type in message.attributes:
-                attribute_definitions += f'{Generator.TAB}{attr_name}: {type_map[attr_type]}\n'
-            attribute_definitions = attribute_definitions
-
-            constructor_definition = f'{Generator.TAB}def __init__(self, '
-            constructor_implemenation = ''
-            for attr_name, attr_type in message.attributes:
-                constructor_definition += f'{attr_name}: {type_map[attr_type]}, '
-                constructor_implemenation += f'{Generator.TAB * 2}self.{attr_name} = {attr_name}\n'
-            constructor_definition = constructor_definition[:-2] + '):\n'
-            constructor_implemenation = constructor_implemenation
-            constructor = constructor_definition + constructor_implemenation
-
-            buffer_size = (f'{Generator.TAB}def buffer_size(self) -> int:\n'
-                           f'{Generator.TAB*2}return {message.total_size()}\n')
-
-            struct_format_str = '<'  # Little endian
-            struct_values = ''
-            for attr_name, attr_type in message.attributes:
-                struct_format_str += PY_STRUCT_MAP[attr_type]
-                struct_values += f'self.{attr_name}, '
-            struct_values = struct_values[:-2]
-            encode = (f'{Generator.TAB}def encode(self) -> bytes:\n'
-                      f'{Generator.TAB*2}return {message.header()} + struct.pack(\'{struct_format_str}\', {struct_values})\n')
-
-            struct_values = ''
-            for attr_idx, attr in enumerate(message.attributes):
-                attr_name, attr_type = attr
-                struct_values += f'{attr_name}={type_map[attr_type]}(e[{attr_idx}]), '
-            struct_values = struct_values[:-2]
-            decode = (f'{Generator.TAB}def decode(buffer: bytes) -> \'{message.name}\':\n'
-                      f'{Generator.TAB*2}assert buffer[:2] == b\'Bh\'\n'
-                      f'{Generator.TAB*2}assert int.from_bytes(buffer[2:3], \'little\') == {message.id}\n'
-                      f'{Generator.TAB*2}assert int.from_bytes(buffer[3:5], \'little\') == {message.payload_size()}\n'
-                      f'{Generator.TAB*2}e = struct.unpack(\'{struct_format_str}\', buffer[{message.header_size()}:])\n'
-                      f'{Generator.TAB*2}return {message.name}({struct_values})\n')
-
-            definitions.append(
-                f'class {message.name}:\n'
-                f'{attribute_definitions}\n'
-                f'{constructor}\n'
-                f'{buffer_size}\n'
-                f'{encode}\n'
-                f'{decode}'
-                f'\n'
-                )
-
-        header = textwrap.dedent(f"""\
-            \"\"\"
-            AUTOGENERATED CODE. DO NOT EDIT.
-            Buffham generated from {in_file.name}
-            \"\"\"
-            import numpy as np
-            import struct
-        
-        
-            """)
-
-        with open(out_file, 'w') as fp:
-            fp.write(header)
-            for definition in definitions:
-                fp.write(definition)
+    def _header(in_file: pathlib.Path, language: Languages, schema_hash: str, messages: List[Message]) -> str:
+        if language in _C_FAMILY_TEMPLATES:
+            return Generator._c_family_header(in_file, language, schema_hash)
+        return Generator._python_header(in_file, schema_hash, messages)
 
     @staticmethod
-    def _generate_cxx(in_file: pathlib.Path, out_file: pathlib.Path, messages: List[Message]):
-        definitions = []
-        type_map = LANGUAGE_TYPES[Languages.Cxx]
-        for message in messages:
-            attribute_definitions = ''
-            for attr_name, attr_type in message.attributes:
-                attribute_definitions += f'{Generator.TAB}{type_map[attr_type]} {attr_name};\n'
-            attribute_definitions = attribute_definitions
-
-            # constructor_definition = f'{Generator.TAB}{message.name}('
-            # constructor_implemenation = ''
-            # for attr_name, attr_type in message.attributes:
-            #     constructor_definition += f'{type_map[attr_type]} {attr_name}, '
-            #     constructor_implemenation += f'{Generator.TAB * 2}this->{attr_name} = {attr_name};\n'
-            # constructor_definition = constructor_definition[:-2] + ')'
-            # constructor_implemenation = constructor_implemenation
-            # constructor = constructor_definition + ' {\n' + constructor_implemenation + f'{Generator.TAB}}}\n'
-
-            buffer_size = (f'{Generator.TAB}size_t buffer_size() {{\n'
-                           f'{Generator.TAB*2}return {message.total_size()};\n'
-                           f'{Generator.TAB}}}\n')
-
-            full_header_hex = message.header_hex_array()
-            header_array = ', '.join(['0x' + val for val in full_header_hex])
-            encode_memcpy = (f'{Generator.TAB*2}uint8_t _bh_header[{message.header_size()}] = {{{header_array}}};\n'
-                             # TODO: Don't be dumb with memcpy. Just write out to the pointer
-                             f'{Generator.TAB*2}memcpy(_ptr, &_bh_header, 5);\n')
-            buf_idx = message.header_size()
-            for attr_name, attr_type in message.attributes:
-                encode_memcpy += f'{Generator.TAB*2}memcpy(_ptr + {buf_idx}, &{attr_name}, {TYPE_SIZES[attr_type]});\n'
-                buf_idx += TYPE_SIZES[attr_type]
-            encode = (f'{Generator.TAB}std::unique_ptr<uint8_t> encode() {{\n'
-                      f'{Generator.TAB*2}std::unique_ptr<uint8_t> _buffer(new uint8_t({message.total_size()}));\n'
-                      f'{Generator.TAB*2}uint8_t* _ptr = _buffer.get();\n'
-                      f'{encode_memcpy}'
-                      f'{Generator.TAB*2}return _buffer;\n'
-                      f'{Generator.TAB}}}\n')
-
-            decode_initializer = '{ '
-            buf_idx = message.header_size()
-            for attr_name, attr_type in message.attributes:
-                decode_initializer += f'*({type_map[attr_type]}*)(_ptr + {buf_idx}), '
-                buf_idx += TYPE_SIZES[attr_type]
-            decode_initializer = decode_initializer[:-2] + ' }'
-            decode = (f'{Generator.TAB}static {message.name} decode(const std::unique_ptr<uint8_t>& buffer, size_t len) {{\n'
-                      f'{Generator.TAB*2}uint8_t* _ptr = buffer.get();\n'
-                      f'{Generator.TAB*2}assert(*(_ptr + 0) == \'B\');\n'
-                      f'{Generator.TAB*2}assert(*(_ptr + 1) == \'h\');\n'
-                      f'{Generator.TAB*2}assert(*(_ptr + 2) == {message.id});\n'
-                      f'{Generator.TAB*2}assert(*(uint16_t*)(_ptr + 3) == {message.payload_size()});\n'
-                      f'{Generator.TAB*2}return {decode_initializer};\n'
-                      f'{Generator.TAB}}}\n')
-
-            definitions.append(
-                f'struct {message.name} {{\n'
-                f'{attribute_definitions}\n'
-                # f'{constructor}\n'
-                f'{buffer_size}\n'
-                f'{encode}\n'
-                f'{decode}'
-                f'}};\n'
-                )
-
-
-
-        header = textwrap.dedent(f"""\
-            /*
-             * AUTOGENERATED CODE. DO NOT EDIT.
-             * Buffham generated from {in_file.name}
-             */
-            #include <cassert>
-            #include <memory>
-            #include <stdint.h>
-            #include <string.h>
-        
-        
-            """)
-
-        with open(out_file, 'w') as fp:
-            fp.write(header)
-            for definition in definitions:
-                fp.write(definition)
+    def _hash_macro(in_file: pathlib.Path) -> str:
+        return 'BUFFHAM_' + re.sub(r'\W', '_', in_file.stem).upper() + '_HASH'
 
     @staticmethod
-    def _generate_c(in_file: pathlib.Path, out_file: pathlib.Path, messages: List[Message]):
-        definitions = []
-        type_map = LANGUAGE_TYPES[Languages.Cxx]
-        for message in messages:
-            attribute_definitions = ''
-            for attr_name, attr_type in message.attributes:
-                attribute_definitions += f'{Generator.TAB}{type_map[attr_type]} {attr_name};\n'
-            attribute_definitions = attribute_definitions
-
-            # constructor_definition = f'{Generator.TAB}{message.name}('
-            # constructor_implemenation = ''
-            # for attr_name, attr_type in message.attributes:
-            #     constructor_definition += f'{type_map[attr_type]} {attr_name}, '
-            #     constructor_implemenation += f'{Generator.TAB * 2}this->{attr_name} = {attr_name};\n'
-            # constructor_definition = constructor_definition[:-2] + ')'
-            # constructor_implemenation = constructor_implemenation
-            # constructor = constructor_definition + ' {\n' + constructor_implemenation + f'{Generator.TAB}}}\n'
-
-            buffer_size = (f'size_t {message.name}_buffer_size({message.name}* inst) {{\n'
-                           f'{Generator.TAB}return {message.total_size()};\n'
-                           f'}}\n\n')
-
-            full_header_hex = message.header_hex_array()
-            header_array = ', '.join(['0x' + val for val in full_header_hex])
-            encode_memcpy = (f'{Generator.TAB}uint8_t _bh_header[{message.header_size()}] = {{{header_array}}};\n'
-                             f'{Generator.TAB}memcpy(buffer, &_bh_header, 5);\n')
-            buf_idx = message.header_size()
-            for attr_name, attr_type in message.attributes:
-                encode_memcpy += f'{Generator.TAB}memcpy(buffer + {buf_idx}, &inst->{attr_name}, {TYPE_SIZES[attr_type]});\n'
-                buf_idx += TYPE_SIZES[attr_type]
-            encode = (f'uint8_t* {message.name}_encode({message.name}* inst) {{\n'
-                      f'{Generator.TAB}uint8_t* buffer = (uint8_t*)malloc({message.total_size()});\n'
-                      f'{encode_memcpy}'
-                      f'{Generator.TAB}return buffer;\n'
-                      f'}}\n\n')
-
-            decode_initializer = '{ '
-            buf_idx = message.header_size()
-            for attr_name, attr_type in message.attributes:
-                decode_initializer += f'*({type_map[attr_type]}*)(buffer + {buf_idx}), '
-                buf_idx += TYPE_SIZES[attr_type]
-            decode_initializer = decode_initializer[:-2] + ' }'
-            decode = (f'{message.name} {message.name}_decode(uint8_t* buffer, size_t len) {{\n'
-                      f'{Generator.TAB}{message.name} msg = {decode_initializer};\n'
-                      f'{Generator.TAB}return msg;\n'
-                      f'}}\n\n')
-
-            definitions.append(
-                f'typedef struct {{\n'
-                f'{attribute_definitions}'
-                f'}} {message.name};\n\n'
-                # f'{constructor}\n'
-                f'{buffer_size}'
-                f'{encode}'
-                f'{decode}'
-                )
-
-
-
-        header = textwrap.dedent(f"""\
-            /*
-             * AUTOGENERATED CODE. DO NOT EDIT.
-             * Buffham generated from {in_file.name}
-             */
-            #include <stdint.h>
-            #include <stdlib.h>
-            #include <string.h>
-        
-        
-            """)
-
-        with open(out_file, 'w') as fp:
-            fp.write(header)
-            for definition in definitions:
-                fp.write(definition)
+    def _definition(message: Message, language: Languages) -> str:
+        if language in _C_FAMILY_TEMPLATES:
+            return Generator._c_family_definition(message, language)
+        return Generator._python_definition(message)
 
+    @staticmethod
+    def _python_header(in_file: pathlib.Path, schema_hash: str, messages: List[Message]) -> str:
+        # Messages with the same field types in the same order share one Struct
+        struct_formats = dict.fromkeys([message.struct_format() for message in messages])
+        structs = ''.join([f"_STRUCT_{struct_format} = struct.Struct('<{struct_format}')\n"  # Little endian
+                           for struct_format in struct_formats])
+        return _PYTHON_HEADER_TEMPLATE.format(name=in_file.name, schema_hash=schema_hash, structs=structs)
+
+    @staticmethod
+    def _python_definition(message: Message) -> str:
+        TAB = Generator.TAB
+        TAB2 = TAB + TAB
+        type_map = LANGUAGE_TYPES[Languages.Python]
+        # Resolve each attribute's type names once for all the fragments below
+        fields = tuple([(attr_name, type_map[attr_type], PY_DTYPE_MAP[attr_type])
+                        for attr_name, attr_type in message.attributes])
+        attribute_definitions = ''.join([f'{TAB}{attr_name}: {type_name}\n'
+                                         for attr_name, type_name, _ in fields])
+
+        constructor_args = ', '.join([f'{attr_name}: {type_name}'
+                                      for attr_name, type_name, _ in fields])
+        constructor_body = ''.join([f'{TAB2}self.{attr_name} = {attr_name}\n'
+                                    for attr_name, _, _ in fields])
+
+        encode_values = ', '.join([f'self.{attr_name}' for attr_name, _, _ in fields])
+        decode_values = ', '.join([f'{attr_name}={type_name}(e[{attr_idx}])'
+                                   for attr_idx, (attr_name, type_name, _) in enumerate(fields, 3)])
+        dtype_fields = ', '.join([f'({attr_name!r}, {dtype!r})'
+                                  for attr_name, _, dtype in fields])
+
+        return _PYTHON_DEFINITION_TEMPLATE.format(
+            name=message.name,
+            id=message.id,
+            attribute_definitions=attribute_definitions,
+            slots=tuple([attr_name for attr_name, _, _ in fields]),
+            constructor_args=constructor_args,
+            constructor_body=constructor_body,
+            payload_size=message.payload_size(),
+            struct='_STRUCT_' + message.struct_format(),
+            encode_values=encode_values,
+            decode_values=decode_values,
+            dtype_fields=dtype_fields,
+            first_attr=fields[0][0],
+        )
+
+    @staticmethod
+    def _c_family_header(in_file: pathlib.Path, language: Languages, schema_hash: str) -> str:
+        header_template, _, _ = _C_FAMILY_TEMPLATES[language]
+        return header_template.format(name=in_file.name, hash_macro=Generator._hash_macro(in_file),
+                                      schema_hash=schema_hash)
+
+    @staticmethod
+    def _c_family_definition(message: Message, language: Languages) -> str:
+        TAB = Generator.TAB
+        _, definition_template, static_assert = _C_FAMILY_TEMPLATES[language]
+        type_map = LANGUAGE_TYPES[language]
+        attributes = message.attributes
+        attribute_definitions = ''.join([f'{TAB}{type_map[attr_type]} {attr_name};\n'
+                                         for attr_name, attr_type in attributes])
+
+        layout_asserts = f'{static_assert}(sizeof({message.name}) == {message.payload_size()}, ' \
+                         f'"{message.name} layout does not match its wire payload");\n'
+        layout_asserts += ''.join([f'{static_assert}(offsetof({message.name}, {attr_name}) == {offset}, '
+                                   f'"{message.name}.{attr_name} is not at its wire offset");\n'
+                                   for (attr_name, _), offset in zip(attributes, message.offsets())])
+
+        return definition_template.format(
+            name=message.name,
+            id=message.id,
+            attribute_definitions=attribute_definitions,
+            total_size=message.total_size(),
+            header_size=message.header_size(),
+            payload_size=message.payload_size(),
+            header=message.header(),
+            layout_asserts=layout_asserts,
+        )
 
 if __name__ == '__main__':
     file = pathlib.Path('imu.bh')
@@ -1,4 +1,9 @@
-from buffham.tests.imu_bh import RawImuData
+import pathlib
+
+import buffham.parse as bh
+from buffham.tests.imu_bh import BUFFHAM_HASH, RawImuData
+
+IMU_BH = pathlib.Path(__file__).with_name('imu.bh')
 
 msg = RawImuData(0x11, 0x12, 0x13, 0x14, 0x15, 0x16, 0x17, 0xFFFFFFFFFFFFFFFF)
 
@@ -13,3 +18,24 @@ assert msg.accel_x == decoded_msg.accel_x
 assert msg.accel_y == decoded_msg.accel_y
 assert msg.accel_z == decoded_msg.accel_z
 assert msg.timestamp == decoded_msg.timestamp
+
+buffer = RawImuData.encode_many({attr_name: [getattr(msg, attr_name)] * 3 for attr_name in RawImuData.__slots__})
+
+assert buffer == msg.encode() * 3
+
+decoded_msgs = RawImuData.decode_many(buffer)
+
+assert len(decoded_msgs) == 3
+assert (decoded_msgs['accel_x'] == msg.accel_x).all()
+assert (decoded_msgs['timestamp'] == msg.timestamp).all()
+assert RawImuData.encode_many(decoded_msgs) == buffer
+
+imu_bh = bh.Generator.compile_python(IMU_BH, bh.Parser.parse_file(IMU_BH))
+
+assert imu_bh.BUFFHAM_HASH == BUFFHAM_HASH
+assert imu_bh.RawImuData.decode(msg.encode()).timestamp == msg.timestamp
+
+decoded_msgs = list(RawImuData.iter_decode(msg.encode() * 3))
+
+assert len(decoded_msgs) == 3
+assert all(decoded_msg.timestamp == msg.timestamp for decoded_msg in decoded_msgs)
@@ -0,0 +1,60 @@
+import os
+import pathlib
+import shutil
+import tempfile
+
+import buffham.buffham_gen as gen
+import buffham.parse as bh
+
+with tempfile.TemporaryDirectory() as tmp:
+    tmp_dir = pathlib.Path(tmp)
+    gen.CACHE_DIR = tmp_dir / 'cache'
+    bh_file = tmp_dir / 'imu.bh'
+    shutil.copy(pathlib.Path(__file__).with_name('imu.bh'), bh_file)
+    outputs = {language: bh.Generator.output_file(bh_file, language) for language in bh.Languages}
+    stamp = gen.stamp_file(bh_file)
+
+    # A fresh tree generates every language and stamps the source
+    gen.main(tmp_dir)
+    assert all(output.exists() for output in outputs.values())
+    assert stamp.read_text() == gen.generation_key(bh_file, bh_file.read_bytes())
+    expected = {language: output.read_text() for language, output in outputs.items()}
+
+    # An up to date source leaves its outputs alone, even hand-edited ones
+    outputs[bh.Languages.Cxx].write_text('edited')
+    gen.main(tmp_dir)
+    assert outputs[bh.Languages.Cxx].read_text() == 'edited'
+
+    # --force regenerates everything regardless of the stamp
+    gen.main(tmp_dir, force=True)
+    assert outputs[bh.Languages.Cxx].read_text() == expected[bh.Languages.Cxx]
+
+    # A missing output is regenerated on its own
+    outputs[bh.Languages.Cxx].write_text('edited')
+    outputs[bh.Languages.Python].unlink()
+    gen.main(tmp_dir)
+    assert outputs[bh.Languages.Python].read_text() == expected[bh.Languages.Python]
+    assert outputs[bh.Languages.Cxx].read_text() == 'edited'
+
+    # A different generator invalidates the stamp
+    bh.GENERATOR_DIGEST += b'changed'
+    gen.main(tmp_dir)
+    assert outputs[bh.Languages.Cxx].read_text() == expected[bh.Languages.Cxx]
+    assert stamp.read_text() == gen.generation_key(bh_file, bh_file.read_bytes())
+
+    # So does an edited source
+    bh_file.write_text(bh_file.read_text() + '\nmessage Extra:\n    uint8 x\n')
+    gen.main(tmp_dir)
+    assert 'Extra' in outputs[bh.Languages.Python].read_text()
+
+    # Entries beyond the size cap are evicted, least recently used first
+    assert any(gen.CACHE_DIR.iterdir())
+    gen.prune_cache(0)
+    assert not any(gen.CACHE_DIR.iterdir())
+
+# An empty or relative XDG_CACHE_HOME is ignored rather than used as a relative path
+for xdg_cache_home in ('', 'relative'):
+    os.environ['XDG_CACHE_HOME'] = xdg_cache_home
+    assert gen.cache_dir() == pathlib.Path.home() / '.cache' / 'buffham'
+os.environ['XDG_CACHE_HOME'] = '/tmp/xdg'
+assert gen.cache_dir() == pathlib.Path('/tmp/xdg/buffham')
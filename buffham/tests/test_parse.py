@@ -0,0 +1,39 @@
+import pathlib
+import tempfile
+
+import buffham.parse as bh
+
+
+def parse(source: bytes):
+    with tempfile.TemporaryDirectory() as tmp:
+        bh_file = pathlib.Path(tmp) / 'test.bh'
+        bh_file.write_bytes(source)
+        return bh.Parser.parse_file(bh_file)
+
+
+def parse_error(source: bytes) -> str:
+    try:
+        parse(source)
+    except ValueError as e:
+        return str(e)
+    raise AssertionError('Expected a parse error')
+
+
+# CRLF line endings, comment runs and whitespace-only blank lines
+messages = parse(b'# Header\r\n# comment\r\nmessage A:\r\n  # field\r\n  uint16 a\r\n  uint64 b  \r\n \t\r\n'
+                 b'message B:\r\n\tuint8 c\r\n')
+
+assert [message.name for message in messages] == ['A', 'B']
+assert [message.id for message in messages] == [0, 1]
+assert messages[0].attributes == (('a', bh.Types.UINT16), ('b', bh.Types.UINT64))
+assert messages[1].attributes == (('c', bh.Types.UINT8),)
+
+# Errors report the line they were found on, even after a run of comment lines
+assert parse_error(b'# a\n# b\n# c\n\nmessag X:\n') == \
+    'test.bh:5: Failed to parse messag X: as top-level message declaration'
+assert parse_error(b'message A:\n  # a\n  # b\n  float a\r\n') == \
+    'test.bh:4: Failed to parse   float a as an attribute of A'
+assert parse_error(b'message A:\n  uint8 a\n\n# c\nmessage B:\n\n') == \
+    'test.bh:5: Expected B to have attributes'
+assert parse_error(b'message A:\n  uint8 _bh_id\n') == \
+    'test.bh:2: Attribute name _bh_id is reserved; names may not start with _bh_'
@@ -2,13 +2,21 @@
 
 from distutils.core import setup
 
+try:
+    # Compile the parser and generator to a C extension when mypyc is available
+    from mypyc.build import mypycify
+    ext_modules = mypycify(['buffham/parse.py'])
+except ImportError:
+    ext_modules = []  # buffham.parse is used as plain Python
+
 setup(name='buffham',
       version='0.1',
       description='BuffHam Encoding Utilities',
       author='Ryan Draves',
       author_email='dravesr@umich.edu',
       packages=['buffham'],
+      ext_modules=ext_modules,
       scripts=[
           'buffham/buffham_gen.py'
       ]
-     )
\ No newline at end of file
+     )